@@ -0,0 +1,328 @@
+import os, json, time, shutil, hashlib, threading
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from PIL import Image
+
+from ..utils.env_utils import get_env_number
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Load environment variables from a .env file, as core/auth.py does
+load_dotenv()
+
+# Journal location, overridable from the .env file
+JOURNAL_DIR = os.getenv("NANO_BANANA_JOURNAL_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "journal"
+)
+
+# Entries older than this are not reused and are pruned, 0 keeps them forever
+JOURNAL_MAX_AGE_MINUTES = get_env_number("NANO_BANANA_JOURNAL_MAX_AGE_MINUTES", 60)
+
+# Total size of stored images before the oldest entries are pruned, 0 disables the cap
+JOURNAL_MAX_SIZE_MB = get_env_number("NANO_BANANA_JOURNAL_MAX_SIZE_MB", 1024)
+
+INDEX_FILENAME = "index.jsonl"
+BLOBS_DIRNAME = "blobs"
+LOCK_FILENAME = ".lock"
+
+
+def _lock_file(f):
+    """Take an exclusive lock on an open file, blocking until it is available."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def request_hash(model_name, contents, **params):
+    """
+    Compute a stable hash identifying a generation request.
+
+    Args:
+        model_name (str): Model the request is sent to.
+        contents (list): Request contents (strings and PIL images).
+        **params: Generation settings that affect the result (aspect ratio, size, ...).
+
+    Returns:
+        str: Hex SHA-256 digest of the request.
+    """
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+
+    for item in contents:
+        if isinstance(item, Image.Image):
+            digest.update(f"image:{item.mode}:{item.size}".encode("utf-8"))
+            digest.update(item.tobytes())
+        else:
+            digest.update(f"text:{item}".encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+class ResultJournal:
+    """
+    Append-only on-disk journal of completed generations.
+
+    Each entry is one JSON line in the index file; image bytes are stored once
+    as content-addressed blobs so repeated images are not duplicated. Callers
+    retire a run's entries once it finished, so only unfinished runs are resumed.
+    Entries expire after max_age_minutes and the oldest are pruned once the
+    blobs exceed max_size_mb.
+    """
+
+    def __init__(self, directory=JOURNAL_DIR, max_age_minutes=JOURNAL_MAX_AGE_MINUTES, max_size_mb=JOURNAL_MAX_SIZE_MB):
+        self.directory = directory
+        self.index_path = os.path.join(directory, INDEX_FILENAME)
+        self.blobs_dir = os.path.join(directory, BLOBS_DIRNAME)
+        self.lock_path = os.path.join(directory, LOCK_FILENAME)
+        self.max_age_minutes = max_age_minutes
+        self.max_size_mb = max_size_mb
+        self._entries = None
+        self._signature = None
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+
+    @contextmanager
+    def _locked(self):
+        """
+        Hold the thread lock and an exclusive lock on the journal directory.
+
+        The file lock keeps other processes and other ResultJournal instances
+        sharing the directory from appending while the index is rewritten.
+        """
+        with self._lock:
+            if self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.lock_path, "a+") as f:
+                _lock_file(f)
+                self._lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth = 0
+                    _unlock_file(f)
+
+    def _index_signature(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _read_index(self):
+        """Read the index file, keeping the latest entry per request hash."""
+        entries = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A crash mid-append can leave a truncated line
+                        continue
+                    if entry.get("retired"):
+                        entries.pop(entry["request_hash"], None)
+                        continue
+                    entries[entry["request_hash"]] = entry
+        return entries
+
+    def _index(self):
+        """Return the in-memory index, re-reading it when the file changed on disk."""
+        if self._entries is None:
+            self._entries = self._read_index()
+            self._signature = self._index_signature()
+            if self._signature is not None:
+                self.prune()
+        elif self._index_signature() != self._signature:
+            # Another writer appended or compacted the index
+            self._entries = self._read_index()
+            self._signature = self._index_signature()
+        return self._entries
+
+    def _blob_path(self, blob_hash):
+        return os.path.join(self.blobs_dir, blob_hash[:2], blob_hash)
+
+    def _write_blob(self, data):
+        """Store bytes under their SHA-256 digest and return the digest."""
+        blob_hash = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(blob_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        return blob_hash
+
+    def _append_index(self, lines):
+        """Append lines to the index file; the caller holds the directory lock."""
+        if os.path.exists(self.index_path) and os.path.getsize(self.index_path) > 0:
+            # Terminate a line left truncated by a crash so these entries stay parseable
+            with open(self.index_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    lines = "\n" + lines
+
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _is_expired(self, entry, now):
+        return self.max_age_minutes > 0 and now - entry.get("created_at", 0) > self.max_age_minutes * 60
+
+    def _blob_size(self, entry):
+        if "size" in entry:
+            return entry["size"]
+        path = self._blob_path(entry["image_blob"])
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def prune(self):
+        """
+        Drop expired entries and the oldest entries beyond the size cap.
+
+        The index is re-read from disk under the directory lock so entries written
+        by other journals are kept, then rewritten with the surviving entries,
+        which also removes any truncated line. Blobs no longer referenced are
+        deleted; in-progress temporary files are left alone.
+        """
+        with self._locked():
+            entries = self._read_index()
+            if not entries and not os.path.exists(self.index_path):
+                self._entries = {}
+                return
+
+            now = time.time()
+            max_bytes = self.max_size_mb * 1024 * 1024
+            kept = {}
+            kept_blobs = set()
+            total = 0
+            for entry in sorted(entries.values(), key=lambda e: e.get("created_at", 0), reverse=True):
+                if self._is_expired(entry, now):
+                    continue
+                if entry["image_blob"] not in kept_blobs:
+                    size = self._blob_size(entry)
+                    if max_bytes > 0 and total + size > max_bytes:
+                        continue
+                    total += size
+                    kept_blobs.add(entry["image_blob"])
+                kept[entry["request_hash"]] = entry
+
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry in sorted(kept.values(), key=lambda e: e.get("created_at", 0)):
+                    f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.index_path)
+            self._entries = kept
+            self._signature = self._index_signature()
+
+            if os.path.isdir(self.blobs_dir):
+                for root, _, files in os.walk(self.blobs_dir):
+                    for name in files:
+                        if name.endswith(".tmp") or name in kept_blobs:
+                            continue
+                        os.remove(os.path.join(root, name))
+
+    def retire(self, req_hashes):
+        """Mark entries as no longer resumable by appending a retirement line for each."""
+        req_hashes = [req_hash for req_hash in req_hashes if req_hash]
+        if not req_hashes:
+            return
+
+        with self._locked():
+            entries = self._index()
+            lines = "".join(json.dumps({"request_hash": req_hash, "retired": True}) + "\n" for req_hash in req_hashes)
+            self._append_index(lines)
+            for req_hash in req_hashes:
+                entries.pop(req_hash, None)
+
+    def clear(self):
+        """Delete every journaled result."""
+        with self._locked():
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            shutil.rmtree(self.blobs_dir, ignore_errors=True)
+            self._entries = {}
+            self._signature = None
+
+    def lookup(self, req_hash):
+        """
+        Find a journaled result for a request.
+
+        Returns:
+            dict: Entry with "image_bytes", "text" and "grounding_sources", or None if not found or expired.
+        """
+        with self._lock:
+            entry = self._index().get(req_hash)
+        if entry is None or self._is_expired(entry, time.time()):
+            return None
+
+        path = self._blob_path(entry["image_blob"])
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            image_bytes = f.read()
+
+        return {
+            "image_bytes": image_bytes,
+            "text": entry.get("text", ""),
+            "grounding_sources": entry.get("grounding_sources", ""),
+        }
+
+    def record(self, req_hash, image_bytes, text="", grounding_sources=""):
+        """Persist a decoded response as soon as it arrives."""
+        with self._locked():
+            entries = self._index()
+            blob_hash = self._write_blob(image_bytes)
+            entry = {
+                "request_hash": req_hash,
+                "image_blob": blob_hash,
+                "size": len(image_bytes),
+                "text": text,
+                "grounding_sources": grounding_sources,
+                "created_at": time.time(),
+            }
+            self._append_index(json.dumps(entry) + "\n")
+            entries[req_hash] = entry
+
+            blob_sizes = {e["image_blob"]: self._blob_size(e) for e in entries.values()}
+            if self.max_size_mb > 0 and sum(blob_sizes.values()) > self.max_size_mb * 1024 * 1024:
+                self.prune()
+
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def get_journal(directory=JOURNAL_DIR):
+    """Return the shared journal for a directory."""
+    with _journals_lock:
+        if directory not in _journals:
+            _journals[directory] = ResultJournal(directory)
+        return _journals[directory]
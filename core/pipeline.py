@@ -0,0 +1,372 @@
+import io, time, threading, torch
+
+from PIL import Image
+
+from google import genai
+from google.genai import types
+
+from .auth import PROJECT_ID, LOCATION, GOOGLE_API_KEY
+from .journal import get_journal, request_hash
+from ..utils.image_utils import tensor_to_pil, pil_to_tensor
+from ..utils.env_utils import get_env_number
+
+# Upper bound on requests in flight across all nodes using the default stages
+MAX_CONCURRENT_REQUESTS = get_env_number("NANO_BANANA_MAX_CONCURRENT_REQUESTS", 4, minimum=1, cast=int)
+
+
+def build_config(aspect_ratio, image_size, temperature, use_search=False):
+    """Centralized config creation with proper AFC handling."""
+    config = types.GenerateContentConfig(
+        response_modalities=["TEXT", "IMAGE"],
+        image_config=types.ImageConfig(
+            aspect_ratio=aspect_ratio,
+            image_size=image_size
+        ),
+        temperature=temperature,
+        # FIX: Disable AFC to prevent malformed function calls
+        automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True)
+    )
+
+    if use_search:
+        try:
+            # FIX: Add tool safely
+            config.tools = [types.Tool(google_search=types.GoogleSearch())]
+        except Exception as e:
+            print(f"Warning: Search tool not supported: {e}")
+
+    return config
+
+
+class GenerationRequest:
+    """
+    A single image generation request.
+
+    Args:
+        node (str): Name of the calling node, part of the request hash.
+        node_id (str): ComfyUI unique_id of the calling node, part of the request hash.
+        approach (str): "VERTEXAI" or "API", as returned by detect_approach().
+        model_name (str): Model the request is sent to.
+        contents (list): Prompt strings, PIL images and/or image tensors.
+        params (dict): aspect_ratio, image_size, temperature and optionally use_search.
+        chat (bool): Send through a chat session instead of generate_content.
+        resume_from_journal (bool): Reuse a journaled result left by an unfinished run of the same node.
+        extract_metadata (callable): Builds the metadata string from the raw response.
+    """
+
+    def __init__(self, node, approach, model_name, contents, params, chat=False, resume_from_journal=True, extract_metadata=None, node_id=None):
+        self.node = node
+        self.node_id = node_id
+        self.approach = approach
+        self.model_name = model_name
+        self.contents = contents
+        self.params = params
+        self.chat = chat
+        self.resume_from_journal = resume_from_journal
+        self.extract_metadata = extract_metadata
+
+
+class PipelineContext:
+    """State threaded through the pipeline stages for one request."""
+
+    def __init__(self, request):
+        self.request = request
+        self.contents = None
+        self.request_hash = None
+        self.response = None
+        self.image_bytes = None
+        self.text = ""
+        self.metadata = ""
+        self.image_tensor = None
+        self.from_journal = False
+        self.timings = {}
+
+
+class GenAITransport:
+    """Sends requests through the google-genai SDK, reusing one client per endpoint."""
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def create_client(self, approach, model_name):
+        """Return a client for the approach, creating it on first use."""
+        if approach == "VERTEXAI":
+            if not PROJECT_ID or not LOCATION:
+                raise ValueError("PROJECT_ID or LOCATION not configured in .env for Vertex AI approach")
+
+            # Use global location for nanobanana models as they may only be available on global endpoint
+            location = "global" if "gemini-3-pro" in model_name else LOCATION
+            key = (approach, location)
+        else:  # API approach
+            if not GOOGLE_API_KEY:
+                raise ValueError("GOOGLE_API_KEY not configured in .env for API approach")
+
+            key = (approach, None)
+
+        with self._lock:
+            if key not in self._clients:
+                if approach == "VERTEXAI":
+                    self._clients[key] = genai.Client(vertexai=True, project=PROJECT_ID, location=key[1])
+                else:
+                    self._clients[key] = genai.Client(api_key=GOOGLE_API_KEY)
+            return self._clients[key]
+
+    def send(self, request, contents, config):
+        """Send the request and return the raw API response."""
+        client = self.create_client(request.approach, request.model_name)
+
+        if request.chat:
+            # Create and send message in a fresh chat session
+            chat = client.chats.create(
+                model=request.model_name,
+                config=config
+            )
+            return chat.send_message(message=contents)
+
+        return client.models.generate_content(
+            model=request.model_name,
+            contents=contents,
+            config=config
+        )
+
+
+class FakeTransport:
+    """
+    Transport test double returning canned responses without network access.
+
+    Args:
+        image_bytes (bytes): Encoded image returned in every response.
+        text (str): Text part returned alongside the image.
+        latency (float): Seconds to sleep per request, to simulate the API when benchmarking.
+    """
+
+    def __init__(self, image_bytes, text="", latency=0.0):
+        self.image_bytes = image_bytes
+        self.text = text
+        self.latency = latency
+        self.requests = []
+
+    def send(self, request, contents, config):
+        self.requests.append((request, contents, config))
+        if self.latency:
+            time.sleep(self.latency)
+
+        parts = [types.Part(inline_data=types.Blob(data=self.image_bytes, mime_type="image/png"))]
+        if self.text:
+            parts.append(types.Part(text=self.text))
+
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(
+                content=types.Content(role="model", parts=parts),
+                finish_reason=types.FinishReason.STOP
+            )]
+        )
+
+
+class EncodeStage:
+    """Converts image tensors to PIL images and hashes the request."""
+    name = "encode"
+
+    def __call__(self, ctx, proceed):
+        request = ctx.request
+        ctx.contents = [tensor_to_pil(item) if isinstance(item, torch.Tensor) else item for item in request.contents]
+        ctx.request_hash = request_hash(
+            request.model_name, ctx.contents, node=request.node, node_id=request.node_id, **request.params
+        )
+        proceed()
+
+
+class LimitStage:
+    """Bounds the number of requests in flight."""
+    name = "limit"
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_REQUESTS):
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be at least 1")
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+
+    def __call__(self, ctx, proceed):
+        with self._semaphore:
+            proceed()
+
+
+class CacheStage:
+    """Fills the context from the result journal when an identical request already completed."""
+    name = "cache"
+
+    def __init__(self, journal=None):
+        self.journal = journal
+
+    def __call__(self, ctx, proceed):
+        if ctx.request.resume_from_journal:
+            try:
+                journaled = (self.journal or get_journal()).lookup(ctx.request_hash)
+            except OSError as e:
+                print(f"\033[93mWarning: Could not read result journal: {e}\033[0m")
+                journaled = None
+            if journaled is not None:
+                print(f"Resuming from journal entry {ctx.request_hash[:12]}")
+                ctx.image_bytes = journaled["image_bytes"]
+                ctx.text = journaled["text"]
+                ctx.metadata = journaled["grounding_sources"]
+                ctx.from_journal = True
+        proceed()
+
+
+class SendStage:
+    """Sends the request, validates the finish reason and parses the response parts."""
+    name = "send"
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def __call__(self, ctx, proceed):
+        if not ctx.from_journal:
+            request = ctx.request
+            config = build_config(
+                request.params["aspect_ratio"], request.params["image_size"],
+                request.params["temperature"], request.params.get("use_search", False)
+            )
+            response = self.transport.send(request, ctx.contents, config)
+            ctx.response = response
+
+            # Validate response and check finish reason
+            if not response.candidates:
+                raise ValueError("API returned no candidates.")
+
+            # Check if generation was successful
+            if hasattr(response.candidates[0], 'finish_reason') and response.candidates[0].finish_reason != types.FinishReason.STOP:
+                reason = response.candidates[0].finish_reason
+                # Add debug information as suggested in the error report
+                print(f"Debug: Full response - {response}")
+                print(f"Debug: Candidates - {response.candidates[0]}")
+                if hasattr(response.candidates[0], 'content'):
+                    print(f"Debug: Parts - {response.candidates[0].content.parts}")
+                raise ValueError(f"Generation failed with reason: {reason}")
+
+            # Parse the response
+            image_bytes = None
+            text_response = ""
+
+            for part in response.candidates[0].content.parts:
+                if hasattr(part, 'inline_data') and part.inline_data and image_bytes is None:
+                    image_bytes = part.inline_data.data
+                elif hasattr(part, 'text') and part.text:
+                    text_response += part.text
+
+            if image_bytes is None:
+                raise ValueError("No image data found in the API response.")
+
+            ctx.image_bytes = image_bytes
+            ctx.text = text_response
+            if request.extract_metadata is not None:
+                ctx.metadata = request.extract_metadata(response)
+
+        proceed()
+
+
+class DecodeStage:
+    """Decodes the image bytes into a ComfyUI image tensor."""
+    name = "decode"
+
+    def __call__(self, ctx, proceed):
+        pil_image = Image.open(io.BytesIO(ctx.image_bytes)).convert("RGB")
+        ctx.image_tensor = pil_to_tensor(pil_image)
+        proceed()
+
+
+class JournalStage:
+    """Persists fresh results so a later failure does not lose this paid generation."""
+    name = "journal"
+
+    def __init__(self, journal=None):
+        self.journal = journal
+
+    def __call__(self, ctx, proceed):
+        if not ctx.from_journal:
+            try:
+                (self.journal or get_journal()).record(ctx.request_hash, ctx.image_bytes, ctx.text, ctx.metadata)
+            except OSError as e:
+                # A journal that cannot be written must not cost the generation itself
+                print(f"\033[93mWarning: Could not write result journal: {e}\033[0m")
+        proceed()
+
+
+# Shared by every default pipeline so the limit applies across all node instances
+SHARED_LIMIT = LimitStage()
+
+
+def default_stages(transport=None, journal=None):
+    """Return the standard encode -> limit -> cache -> send -> decode -> journal stages."""
+    return [
+        EncodeStage(),
+        SHARED_LIMIT,
+        CacheStage(journal),
+        SendStage(transport or GenAITransport()),
+        DecodeStage(),
+        JournalStage(journal),
+    ]
+
+
+class GenerationPipeline:
+    """
+    Runs a GenerationRequest through a chain of stages.
+
+    Each stage is a callable taking (ctx, proceed) and must call proceed() to run the
+    remaining stages, which lets stages like LimitStage wrap everything downstream.
+
+    Args:
+        stages (list): Stages to run, defaults to default_stages(transport).
+        transport: Object with a send(request, contents, config) method, e.g. FakeTransport.
+        journal (ResultJournal): Journal used by the default stages instead of the shared one.
+        hooks (list): Callables invoked as hook(stage_name, ctx, seconds) after each stage,
+                      where seconds excludes the time spent in downstream stages.
+    """
+
+    def __init__(self, stages=None, transport=None, journal=None, hooks=None):
+        if stages is not None and (transport is not None or journal is not None):
+            raise ValueError("Pass transport and journal to default_stages() when providing custom stages")
+        self.stages = stages if stages is not None else default_stages(transport, journal)
+        self.journal = journal
+        self.hooks = list(hooks or [])
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def retire(self, request_hashes):
+        """Retire the journal entries of a finished run so later runs generate fresh results."""
+        try:
+            (self.journal or get_journal()).retire(request_hashes)
+        except OSError as e:
+            print(f"\033[93mWarning: Could not update result journal: {e}\033[0m")
+
+    def run(self, request):
+        """
+        Run the request through all stages.
+
+        Returns:
+            PipelineContext: Context holding image_tensor, image_bytes, text and metadata.
+        """
+        ctx = PipelineContext(request)
+        self._run_stage(0, ctx)
+        return ctx
+
+    def _run_stage(self, index, ctx):
+        if index >= len(self.stages):
+            return
+
+        stage = self.stages[index]
+        downstream = [0.0]
+
+        def proceed():
+            start = time.perf_counter()
+            self._run_stage(index + 1, ctx)
+            downstream[0] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        stage(ctx, proceed)
+        elapsed = time.perf_counter() - start - downstream[0]
+
+        ctx.timings[stage.name] = elapsed
+        for hook in self.hooks:
+            hook(stage.name, ctx, elapsed)
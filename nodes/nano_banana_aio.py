@@ -1,17 +1,18 @@
-import io, torch, numpy as np
-from PIL import Image
+import torch
 
-from google import genai
-from google.genai import types
-
-from ..core.auth import detect_approach, PROJECT_ID, LOCATION, GOOGLE_API_KEY
-from ..utils.image_utils import tensor_to_pil
+from ..core.auth import detect_approach
+from ..core.pipeline import GenerationPipeline, GenerationRequest
 
 class NanoBananaAIO:
     """A unified multimodal node combining all features: single/multiple image generation, grounding, search, and thinking capabilities."""
+    # Failure count per node unique_id, reported through IS_CHANGED so a failed run executes again on the next queue
+    _failed_runs = {}
+
     def __init__(self):
-        self.client = None
+        self.pipeline = GenerationPipeline()
         self._preview_warning_shown = False  # Track if warning was shown
+        self._unique_id = None
+        self._run_hashes = []  # Journal entries written by the current run
 
     @classmethod
     def INPUT_TYPES(s):
@@ -29,48 +30,33 @@ class NanoBananaAIO:
                 "aspect_ratio": (["1:1", "2:3", "3:2", "3:4", "4:3", "4:5", "5:4", "9:16", "16:9", "21:9"], {"default": "1:1"}),
                 "image_size": (["1K", "2K", "4K"], {"default": "2K"}),
                 "temperature": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 2.0, "step": 0.1}),
+                "resume_from_journal": ("BOOLEAN", {"default": True}),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
             }
         }
 
+    @classmethod
+    def IS_CHANGED(s, unique_id=None, **kwargs):
+        # ComfyUI caches the error output of a failed run; report a change so the retry resumes from the journal
+        return s._failed_runs.get(unique_id, 0)
+
     RETURN_TYPES = ("IMAGE", "STRING", "STRING")
     RETURN_NAMES = ("images", "thinking", "grounding_sources")
 
     FUNCTION = "generate_unified"
     CATEGORY = "Ru4ls/NanoBanana"
 
-    def _create_config(self, aspect_ratio, image_size, temperature, use_search, model_name):
-        """Centralized config creation with proper AFC handling."""
-        # Show warning only once per node execution
-        if "preview" in model_name and not self._preview_warning_shown:
-            print(f"Warning: Using preview model {model_name} which may have unstable tool support")
-            self._preview_warning_shown = True
-
-        config = types.GenerateContentConfig(
-            response_modalities=["TEXT", "IMAGE"],
-            image_config=types.ImageConfig(
-                aspect_ratio=aspect_ratio,
-                image_size=image_size
-            ),
-            temperature=temperature,
-            # FIX: Disable AFC to prevent malformed function calls
-            automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True)
-        )
-
-        if use_search:
-            try:
-                # FIX: Add tool safely
-                config.tools = [types.Tool(google_search=types.GoogleSearch())]
-            except Exception as e:
-                print(f"Warning: Search tool not supported: {e}")
-
-        return config
-
     def _handle_error(self, message):
         print(f"\033[91mERROR: {message}\033[0m")
+        NanoBananaAIO._failed_runs[self._unique_id] = NanoBananaAIO._failed_runs.get(self._unique_id, 0) + 1
         # Always return the same number of outputs to maintain ComfyUI compatibility
         return (torch.zeros(1, 64, 64, 3), "", "")
 
-    def generate_unified(self, model_name, prompt, image_count=1, use_search=True, image_1=None, image_2=None, image_3=None, image_4=None, image_5=None, image_6=None, aspect_ratio="1:1", image_size="2K", temperature=1.0):
+    def generate_unified(self, model_name, prompt, image_count=1, use_search=True, image_1=None, image_2=None, image_3=None, image_4=None, image_5=None, image_6=None, aspect_ratio="1:1", image_size="2K", temperature=1.0, resume_from_journal=True, unique_id=None):
+        self._unique_id = unique_id
+        self._run_hashes = []
         try:
             approach = detect_approach()
 
@@ -94,27 +80,36 @@ class NanoBananaAIO:
             if image_size not in valid_sizes:
                 return self._handle_error(f"Invalid image size. Valid options: {', '.join(valid_sizes)}")
 
-            # Prepare contents
+            # Show warning only once per node execution
+            if "preview" in model_name and not self._preview_warning_shown:
+                print(f"Warning: Using preview model {model_name} which may have unstable tool support")
+                self._preview_warning_shown = True
+
+            # Prepare contents, image tensors are encoded by the pipeline
             contents = [prompt]
             images = [image_1, image_2, image_3, image_4, image_5, image_6]
             for img_tensor in images:
                 if img_tensor is not None:
-                    contents.append(tensor_to_pil(img_tensor))
+                    contents.append(img_tensor)
 
             # If image_count is 1, behave like single image generation, otherwise generate multiple
             if image_count == 1:
                 # Single image generation (like NanoBananaGrounding)
-                return self._generate_single_image(
+                result = self._generate_single_image(
                     model_name, prompt, use_search, approach, contents,
-                    aspect_ratio, image_size, temperature
+                    aspect_ratio, image_size, temperature, resume_from_journal
                 )
             else:
                 # Multiple image generation (like Multi Image Generation)
-                return self._generate_multiple_images(
+                result = self._generate_multiple_images(
                     model_name, prompt, image_count, use_search, approach, contents,
-                    aspect_ratio, image_size, temperature
+                    aspect_ratio, image_size, temperature, resume_from_journal
                 )
 
+            # The run finished, so its results are no longer needed for a retry
+            self.pipeline.retire(self._run_hashes)
+            return result
+
         except ValueError as e:
             return self._handle_error(f"ValueError in NanoBananaAIO: {e}")
         except TypeError as e:
@@ -122,65 +117,13 @@ class NanoBananaAIO:
         except Exception as e:
             return self._handle_error(f"{type(e).__name__} in NanoBananaAIO: {e}")
 
-    def _generate_single_image(self, model_name, prompt, use_search, approach, contents, aspect_ratio, image_size, temperature):
+    def _generate_single_image(self, model_name, prompt, use_search, approach, contents, aspect_ratio, image_size, temperature, resume_from_journal=True):
         """Generate a single image with grounding capabilities."""
-        if approach == "VERTEXAI":
-            if not PROJECT_ID or not LOCATION:
-                return self._handle_error("PROJECT_ID or LOCATION not configured in .env for Vertex AI approach")
-
-            # Use global location for nanobanana models as they may only be available on global endpoint
-            location = "global" if "gemini-3-pro" in model_name else LOCATION
-            client = genai.Client(vertexai=True, project=PROJECT_ID, location=location)
-        else:  # API approach
-            if not GOOGLE_API_KEY:
-                return self._handle_error("GOOGLE_API_KEY not configured in .env for API approach")
-
-            client = genai.Client(api_key=GOOGLE_API_KEY)
-
-        # Create config using the centralized method
-        config = self._create_config(aspect_ratio, image_size, temperature, use_search, model_name)
-
-        response = client.models.generate_content(
-            model=model_name,
-            contents=contents,
-            config=config
-        )
-
-        # Validate response and check finish reason
-        if not response.candidates:
-            return self._handle_error("API returned no candidates.")
-
-        # Check if generation was successful
-        if hasattr(response.candidates[0], 'finish_reason') and response.candidates[0].finish_reason != types.FinishReason.STOP:
-            reason = response.candidates[0].finish_reason
-            # Add debug information as suggested in the error report
-            print(f"Debug: Full response - {response}")
-            if hasattr(response, 'candidates') and response.candidates:
-                print(f"Debug: Candidates - {response.candidates[0]}")
-                if hasattr(response.candidates[0], 'content'):
-                    print(f"Debug: Parts - {response.candidates[0].content.parts}")
-            return self._handle_error(f"Generation failed with reason: {reason}")
-
-        # Parse the response
-        image_bytes = None
-        text_response = ""
-
-        for part in response.candidates[0].content.parts:
-            if part.inline_data and image_bytes is None:
-                image_bytes = part.inline_data.data
-            elif part.text:
-                text_response += part.text
-
-        # Extract grounding information
-        grounding_sources = self.extract_grounding_data(response)
-
-        if image_bytes is None:
-            return self._handle_error("No image data found in the API response.")
-
-        pil_image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        ctx = self._run_request(model_name, approach, contents, aspect_ratio, image_size, temperature, use_search, resume_from_journal)
 
-        image_np = np.array(pil_image).astype(np.float32) / 255.0
-        image_tensor = torch.from_numpy(image_np)[None,]
+        image_tensor = ctx.image_tensor
+        text_response = ctx.text
+        grounding_sources = ctx.metadata
 
         # For API approach, provide a helpful message about needing Vertex AI for full text response
         if approach == "API":
@@ -189,7 +132,28 @@ class NanoBananaAIO:
 
         return (image_tensor, text_response, grounding_sources)
 
-    def _generate_multiple_images(self, model_name, prompt, image_count, use_search, approach, contents, aspect_ratio, image_size, temperature):
+    def _run_request(self, model_name, approach, contents, aspect_ratio, image_size, temperature, use_search, resume_from_journal):
+        """Run one generation request through the shared pipeline."""
+        request = GenerationRequest(
+            node="NanoBananaAIO",
+            approach=approach,
+            model_name=model_name,
+            contents=contents,
+            params={
+                "aspect_ratio": aspect_ratio,
+                "image_size": image_size,
+                "temperature": temperature,
+                "use_search": use_search,
+            },
+            resume_from_journal=resume_from_journal,
+            extract_metadata=self.extract_grounding_data,
+            node_id=self._unique_id
+        )
+        ctx = self.pipeline.run(request)
+        self._run_hashes.append(ctx.request_hash)
+        return ctx
+
+    def _generate_multiple_images(self, model_name, prompt, image_count, use_search, approach, contents, aspect_ratio, image_size, temperature, resume_from_journal=True):
         """Generate multiple images with grounding capabilities."""
         generated_images = []
         all_text_responses = []
@@ -202,67 +166,14 @@ class NanoBananaAIO:
             # Create a copy of contents with the updated prompt for this iteration
             current_contents = [current_prompt] + contents[1:]  # Keep images, update prompt
 
-            if approach == "VERTEXAI":
-                if not PROJECT_ID or not LOCATION:
-                    return self._handle_error("PROJECT_ID or LOCATION not configured in .env for Vertex AI approach")
-
-                # Use global location for nanobanana models as they may only be available on global endpoint
-                location = "global" if "gemini-3-pro" in model_name else LOCATION
-                client = genai.Client(vertexai=True, project=PROJECT_ID, location=location)
-            else:  # API approach
-                if not GOOGLE_API_KEY:
-                    return self._handle_error("GOOGLE_API_KEY not configured in .env for API approach")
-
-                client = genai.Client(api_key=GOOGLE_API_KEY)
-
-            # Create config using the centralized method
-            config = self._create_config(aspect_ratio, image_size, temperature, use_search, model_name)
-
-            response = client.models.generate_content(
-                model=model_name,
-                contents=current_contents,
-                config=config
+            ctx = self._run_request(
+                model_name, approach, current_contents, aspect_ratio, image_size,
+                temperature, use_search, resume_from_journal
             )
 
-            # Validate response and check finish reason
-            if not response.candidates:
-                return self._handle_error("API returned no candidates.")
-
-            # Check if generation was successful
-            if hasattr(response.candidates[0], 'finish_reason') and response.candidates[0].finish_reason != types.FinishReason.STOP:
-                reason = response.candidates[0].finish_reason
-                # Add debug information as suggested in the error report
-                print(f"Debug: Full response - {response}")
-                if hasattr(response, 'candidates') and response.candidates:
-                    print(f"Debug: Candidates - {response.candidates[0]}")
-                    if hasattr(response.candidates[0], 'content'):
-                        print(f"Debug: Parts - {response.candidates[0].content.parts}")
-                return self._handle_error(f"Generation failed with reason: {reason}")
-
-            # Parse the response
-            image_bytes = None
-            text_response = ""
-
-            for part in response.candidates[0].content.parts:
-                if part.inline_data and image_bytes is None:
-                    image_bytes = part.inline_data.data
-                elif part.text:
-                    text_response += part.text
-
-            # Extract grounding information
-            grounding_sources = self.extract_grounding_data(response)
-
-            if image_bytes is None:
-                return self._handle_error("No image data found in the API response.")
-
-            pil_image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-
-            image_np = np.array(pil_image).astype(np.float32) / 255.0
-            image_tensor = torch.from_numpy(image_np)[None,]
-
-            generated_images.append(image_tensor)
-            all_text_responses.append(text_response)
-            all_grounding_sources.append(grounding_sources)
+            generated_images.append(ctx.image_tensor)
+            all_text_responses.append(ctx.text)
+            all_grounding_sources.append(ctx.metadata)
 
         # Combine all generated images into a single tensor
         # This assumes all images have the same dimensions
@@ -1,11 +1,8 @@
-import io, torch, numpy as np
+import io, torch
 from PIL import Image
 
-from google import genai
-from google.genai import types
-
-from ..core.auth import detect_approach, PROJECT_ID, LOCATION, GOOGLE_API_KEY
-from ..utils.image_utils import tensor_to_pil
+from ..core.auth import detect_approach
+from ..core.pipeline import GenerationPipeline, GenerationRequest
 
 class NanoBananaMultiTurnChat:
     """
@@ -13,8 +10,12 @@ class NanoBananaMultiTurnChat:
     Maintains conversation history and allows iterative image modifications.
     """
 
+    # Failure count per node unique_id, reported through IS_CHANGED so a failed turn executes again on the next queue
+    _failed_runs = {}
+
     def __init__(self):
-        self.client = None
+        self.pipeline = GenerationPipeline()
+        self._unique_id = None
         self.last_image_data = None
         self.conversation_history = []
         self.current_approach = None
@@ -38,9 +39,18 @@ class NanoBananaMultiTurnChat:
             },
             "optional": {
                 "image_input": ("IMAGE",),  # Optional: Initial image to start the conversation with
+                "resume_from_journal": ("BOOLEAN", {"default": True}),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
             }
         }
 
+    @classmethod
+    def IS_CHANGED(s, unique_id=None, **kwargs):
+        # ComfyUI caches the error output of a failed turn; report a change so the retry resumes from the journal
+        return s._failed_runs.get(unique_id, 0)
+
     RETURN_TYPES = ("IMAGE", "STRING", "STRING", "STRING")
     RETURN_NAMES = ("image", "response_text", "metadata", "chat_history")
 
@@ -49,10 +59,12 @@ class NanoBananaMultiTurnChat:
 
     def _handle_error(self, message):
         print(f"\033[91mERROR: {message}\033[0m")
+        NanoBananaMultiTurnChat._failed_runs[self._unique_id] = NanoBananaMultiTurnChat._failed_runs.get(self._unique_id, 0) + 1
         # Always return the same number of outputs to maintain ComfyUI compatibility
         return (torch.zeros(1, 64, 64, 3), "", "", [])
 
-    def generate_multiturn_image(self, model_name, prompt, reset_chat=False, aspect_ratio="1:1", image_size="2K", temperature=1.0, image_input=None):
+    def generate_multiturn_image(self, model_name, prompt, reset_chat=False, aspect_ratio="1:1", image_size="2K", temperature=1.0, image_input=None, resume_from_journal=True, unique_id=None):
+        self._unique_id = unique_id
         try:
             approach = detect_approach()
 
@@ -83,71 +95,37 @@ class NanoBananaMultiTurnChat:
                 print(f"Warning: Using preview model {model_name} which may have unstable tool support")
                 self._preview_warning_shown = True
 
-            # Create client for this request
-            client = self._create_client(approach, model_name)
-
             # Prepare content for the chat message
             contents = [prompt]
 
             # If this is the first message and an initial image is provided, include it
             if len(self.conversation_history) == 0 and image_input is not None:
-                pil_image = tensor_to_pil(image_input)
-                contents.insert(0, pil_image)
+                contents.insert(0, image_input)
             # If we have a previous image from the conversation, include it
             elif self.last_image_data is not None:
                 # Convert the stored image bytes to a format the API can use
                 prev_image = Image.open(io.BytesIO(self.last_image_data))
                 contents.insert(0, prev_image)
 
-            # Create the chat session with configuration for this request
-            config = types.GenerateContentConfig(
-                response_modalities=['TEXT', 'IMAGE'],
-                image_config=types.ImageConfig(
-                    aspect_ratio=aspect_ratio,
-                    image_size=image_size
-                ),
-                temperature=temperature,
-                # FIX: Disable AFC to prevent malformed function calls
-                automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True)
-            )
-
-            # Create and send message in a fresh chat session
-            chat = client.chats.create(
-                model=model_name,
-                config=config
-            )
-
-            response = chat.send_message(
-                message=contents
+            request = GenerationRequest(
+                node="NanoBananaMultiTurnChat",
+                approach=approach,
+                model_name=model_name,
+                contents=contents,
+                params={
+                    "aspect_ratio": aspect_ratio,
+                    "image_size": image_size,
+                    "temperature": temperature,
+                },
+                chat=True,
+                resume_from_journal=resume_from_journal,
+                extract_metadata=self._extract_metadata,
+                node_id=unique_id
             )
-
-            # Validate response and check finish reason
-            if not response.candidates:
-                return self._handle_error("API returned no candidates.")
-
-            # Check if generation was successful
-            if hasattr(response.candidates[0], 'finish_reason') and response.candidates[0].finish_reason != types.FinishReason.STOP:
-                reason = response.candidates[0].finish_reason
-                # Add debug information
-                print(f"Debug: Full response - {response}")
-                if hasattr(response, 'candidates') and response.candidates:
-                    print(f"Debug: Candidates - {response.candidates[0]}")
-                    if hasattr(response.candidates[0], 'content'):
-                        print(f"Debug: Parts - {response.candidates[0].content.parts}")
-                return self._handle_error(f"Generation failed with reason: {reason}")
-
-            # Parse the response
-            image_bytes = None
-            text_response = ""
-
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'inline_data') and part.inline_data and image_bytes is None:
-                    image_bytes = part.inline_data.data
-                elif hasattr(part, 'text') and part.text:
-                    text_response += part.text
-
-            if image_bytes is None:
-                return self._handle_error("No image data found in the API response.")
+            ctx = self.pipeline.run(request)
+            image_bytes = ctx.image_bytes
+            text_response = ctx.text
+            metadata = ctx.metadata
 
             # Update the stored image data for next turn
             self.last_image_data = image_bytes
@@ -158,18 +136,13 @@ class NanoBananaMultiTurnChat:
                 "response": text_response if text_response else "Image generated"
             })
 
-            # Convert image to tensor
-            pil_image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-            image_np = np.array(pil_image).astype(np.float32) / 255.0
-            image_tensor = torch.from_numpy(image_np)[None,]
-
-            # Extract any metadata from the response
-            metadata = self._extract_metadata(response)
-
             # Convert conversation history to a string representation
             chat_history_str = str(self.conversation_history)
 
-            return (image_tensor, text_response, metadata, chat_history_str)
+            # The turn finished, so its result is no longer needed for a retry
+            self.pipeline.retire([ctx.request_hash])
+
+            return (ctx.image_tensor, text_response, metadata, chat_history_str)
 
         except ValueError as e:
             return self._handle_error(f"ValueError in NanoBananaMultiTurnChat: {e}")
@@ -178,29 +151,6 @@ class NanoBananaMultiTurnChat:
         except Exception as e:
             return self._handle_error(f"{type(e).__name__} in NanoBananaMultiTurnChat: {e}")
 
-    def _create_client(self, approach, model_name):
-        """Create a new client based on the approach."""
-        if approach == "VERTEXAI":
-            if not PROJECT_ID or not LOCATION:
-                raise ValueError("PROJECT_ID or LOCATION not configured in .env for Vertex AI approach")
-
-            # Use global location for nanobanana models as they may only be available on global endpoint
-            location = "global" if "gemini-3-pro" in model_name else LOCATION
-            client = genai.Client(
-                vertexai=True,
-                project=PROJECT_ID,
-                location=location
-            )
-        else:  # API approach
-            if not GOOGLE_API_KEY:
-                raise ValueError("GOOGLE_API_KEY not configured in .env for API approach")
-
-            client = genai.Client(
-                api_key=GOOGLE_API_KEY
-            )
-
-        return client
-
     def _extract_metadata(self, response):
         """Extract any relevant metadata from the response."""
         try:
@@ -0,0 +1,21 @@
+import os, sys, importlib.util
+
+import pytest
+
+# Loaded through pytest.ini so it runs before collection, from any working directory.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Register the repository as the "nano_banana" package without running its __init__,
+# which would import every node and initialize Google Cloud authentication.
+if "nano_banana" not in sys.modules:
+    spec = importlib.util.spec_from_loader("nano_banana", loader=None, is_package=True)
+    package = importlib.util.module_from_spec(spec)
+    package.__path__ = [ROOT]
+    sys.modules["nano_banana"] = package
+
+
+def pytest_collect_directory(path, parent):
+    # The repository root has an __init__.py; collect it as a plain directory so
+    # pytest does not import it as a package.
+    if str(path) == ROOT:
+        return pytest.Dir.from_parent(parent, path=path)
@@ -0,0 +1,133 @@
+import os, time
+
+import pytest
+
+pytest.importorskip("PIL")
+
+from nano_banana.core import journal as journal_module
+from nano_banana.core.journal import ResultJournal, get_journal, request_hash
+
+
+class _Clock:
+    """Stands in for the time module inside core.journal, running ahead by offset seconds."""
+
+    def __init__(self, offset):
+        self.offset = offset
+
+    def time(self):
+        return time.time() + self.offset
+
+
+def test_record_and_lookup_round_trip(tmp_path):
+    journal = ResultJournal(str(tmp_path))
+    req_hash = request_hash("model", ["prompt"], aspect_ratio="1:1")
+
+    assert journal.lookup(req_hash) is None
+    journal.record(req_hash, b"image", "text", "sources")
+
+    # A fresh instance reads the entry back from disk
+    entry = ResultJournal(str(tmp_path)).lookup(req_hash)
+    assert entry == {"image_bytes": b"image", "text": "text", "grounding_sources": "sources"}
+
+
+def test_request_hash_depends_on_params():
+    assert request_hash("model", ["prompt"], temperature=1.0) != request_hash("model", ["prompt"], temperature=0.5)
+
+
+def test_record_after_truncated_line_is_readable(tmp_path):
+    journal = ResultJournal(str(tmp_path))
+    journal.record("aaa", b"a")
+
+    # Simulate a crash in the middle of an append
+    with open(journal.index_path, "a", encoding="utf-8") as f:
+        f.write('{"request_hash": "bbb", "ima')
+
+    journal = ResultJournal(str(tmp_path))
+    journal.record("ccc", b"c")
+
+    reloaded = ResultJournal(str(tmp_path))
+    assert reloaded.lookup("aaa")["image_bytes"] == b"a"
+    assert reloaded.lookup("ccc")["image_bytes"] == b"c"
+
+
+def test_record_terminates_truncated_line_without_reload(tmp_path):
+    journal = ResultJournal(str(tmp_path))
+    journal.record("aaa", b"a")
+    with open(journal.index_path, "a", encoding="utf-8") as f:
+        f.write('{"request_hash": "bbb", "ima')
+
+    # The in-memory index is already loaded, so only record() can repair the file
+    journal.record("ccc", b"c")
+    assert ResultJournal(str(tmp_path)).lookup("ccc")["image_bytes"] == b"c"
+
+
+def test_expired_entries_are_not_reused(tmp_path, monkeypatch):
+    journal = ResultJournal(str(tmp_path), max_age_minutes=1)
+    journal.record("old", b"old")
+    monkeypatch.setattr(journal_module, "time", _Clock(120))
+
+    assert journal.lookup("old") is None
+
+    journal.prune()
+    assert not any(files for _, _, files in os.walk(journal.blobs_dir))
+
+
+def test_size_cap_prunes_oldest_entries(tmp_path):
+    journal = ResultJournal(str(tmp_path), max_size_mb=1)
+    journal.record("first", b"x" * 600 * 1024)
+    journal.record("second", b"y" * 600 * 1024)
+
+    assert journal.lookup("first") is None
+    assert journal.lookup("second")["image_bytes"] == b"y" * 600 * 1024
+
+
+def test_clear_removes_everything(tmp_path):
+    journal = ResultJournal(str(tmp_path))
+    journal.record("aaa", b"a")
+    journal.clear()
+
+    assert journal.lookup("aaa") is None
+    assert ResultJournal(str(tmp_path)).lookup("aaa") is None
+
+
+def test_prune_keeps_entries_from_other_writers(tmp_path):
+    a = ResultJournal(str(tmp_path), max_size_mb=1)
+    b = ResultJournal(str(tmp_path), max_size_mb=1)
+    a.record("a1", b"a" * 100)
+    b.record("b1", b"b" * 100)
+
+    # a's in-memory index predates b1; pruning must still keep it
+    a.prune()
+    assert ResultJournal(str(tmp_path)).lookup("b1")["image_bytes"] == b"b" * 100
+
+
+def test_prune_leaves_temporary_files(tmp_path):
+    journal = ResultJournal(str(tmp_path))
+    journal.record("aaa", b"a")
+    in_progress = os.path.join(journal.blobs_dir, "ab", "abcdef.123.tmp")
+    os.makedirs(os.path.dirname(in_progress), exist_ok=True)
+    with open(in_progress, "wb") as f:
+        f.write(b"partial")
+
+    journal.prune()
+    assert os.path.exists(in_progress)
+
+
+def test_get_journal_returns_one_instance_per_directory(tmp_path):
+    assert get_journal(str(tmp_path)) is get_journal(str(tmp_path))
+
+
+def test_retired_entries_are_not_resumed(tmp_path):
+    journal = ResultJournal(str(tmp_path))
+    journal.record("aaa", b"a")
+    journal.record("bbb", b"b")
+    journal.retire(["aaa"])
+
+    assert journal.lookup("aaa") is None
+    reloaded = ResultJournal(str(tmp_path))
+    assert reloaded.lookup("aaa") is None
+    assert reloaded.lookup("bbb")["image_bytes"] == b"b"
+
+    # A later run with the same request is journaled and resumable again
+    journal.record("aaa", b"a2")
+    assert ResultJournal(str(tmp_path)).lookup("aaa")["image_bytes"] == b"a2"
@@ -0,0 +1,87 @@
+import io
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("google.genai")
+pytest.importorskip("vertexai")
+from PIL import Image
+
+from nano_banana.core.journal import ResultJournal
+from nano_banana.core.pipeline import FakeTransport, GenerationPipeline
+from nano_banana.nodes import nano_banana_aio
+from nano_banana.nodes.nano_banana_aio import NanoBananaAIO
+
+MODEL = "gemini-3-pro-image-preview"
+
+
+class FlakyTransport(FakeTransport):
+    """FakeTransport that fails the given call numbers (1-based) once each."""
+
+    def __init__(self, image_bytes, fail_calls=()):
+        super().__init__(image_bytes)
+        self.fail_calls = set(fail_calls)
+        self.calls = 0
+
+    def send(self, request, contents, config):
+        self.calls += 1
+        if self.calls in self.fail_calls:
+            raise ConnectionError("simulated network failure")
+        return super().send(request, contents, config)
+
+
+def _png_bytes():
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 4), (0, 255, 0)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def api_approach(monkeypatch):
+    monkeypatch.setattr(nano_banana_aio, "detect_approach", lambda: "API")
+
+
+def _node(transport, tmp_path):
+    node = NanoBananaAIO()
+    node.pipeline = GenerationPipeline(transport=transport, journal=ResultJournal(str(tmp_path)))
+    return node
+
+
+def _generate(node, unique_id):
+    return node.generate_unified(MODEL, "A nano banana", image_count=4, use_search=False, unique_id=unique_id)
+
+
+def test_requeue_after_partial_failure_resumes_from_journal(tmp_path):
+    transport = FlakyTransport(_png_bytes(), fail_calls={3})
+    node = _node(transport, tmp_path)
+
+    changed_before = NanoBananaAIO.IS_CHANGED(unique_id="resume-1")
+    images, _, _ = _generate(node, "resume-1")
+    assert images.shape == (1, 64, 64, 3)  # error output
+    assert len(transport.requests) == 2
+
+    # The failed run reports a change, so ComfyUI executes the node again on the next queue
+    assert NanoBananaAIO.IS_CHANGED(unique_id="resume-1") != changed_before
+
+    images, _, _ = _generate(node, "resume-1")
+    assert images.shape == (4, 4, 8, 3)
+    # Images 1 and 2 came from the journal; only 3 and 4 were requested again
+    assert len(transport.requests) == 4
+
+    # A successful run reports no further change and retires its entries
+    changed_after_success = NanoBananaAIO.IS_CHANGED(unique_id="resume-1")
+    images, _, _ = _generate(node, "resume-1")
+    assert images.shape == (4, 4, 8, 3)
+    assert len(transport.requests) == 8
+    assert NanoBananaAIO.IS_CHANGED(unique_id="resume-1") == changed_after_success
+
+
+def test_other_nodes_do_not_reuse_unfinished_results(tmp_path):
+    transport = FlakyTransport(_png_bytes(), fail_calls={2})
+    _generate(_node(transport, tmp_path), "resume-2")
+    assert len(transport.requests) == 1
+
+    # A duplicate node with the same inputs generates its own images
+    images, _, _ = _generate(_node(transport, tmp_path), "resume-3")
+    assert images.shape == (4, 4, 8, 3)
+    assert len(transport.requests) == 5
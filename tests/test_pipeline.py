@@ -0,0 +1,86 @@
+import io
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("google.genai")
+pytest.importorskip("vertexai")
+from PIL import Image
+
+from nano_banana.core.journal import ResultJournal
+from nano_banana.core.pipeline import (
+    FakeTransport, GenerationPipeline, GenerationRequest, LimitStage, default_stages
+)
+
+
+def _png_bytes(color=(255, 0, 0)):
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 4), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _request(prompt="A nano banana", **kwargs):
+    return GenerationRequest(
+        node="test",
+        approach="API",
+        model_name="gemini-3-pro-image-preview",
+        contents=[prompt],
+        params={"aspect_ratio": "1:1", "image_size": "1K", "temperature": 1.0},
+        **kwargs
+    )
+
+
+def test_fake_transport_runs_end_to_end(tmp_path):
+    transport = FakeTransport(_png_bytes(), text="done")
+    timings = []
+    pipeline = GenerationPipeline(
+        transport=transport,
+        journal=ResultJournal(str(tmp_path)),
+        hooks=[lambda name, ctx, seconds: timings.append(name)]
+    )
+
+    ctx = pipeline.run(_request(extract_metadata=lambda response: "metadata"))
+
+    assert ctx.image_tensor.shape == (1, 4, 8, 3)
+    assert ctx.text == "done"
+    assert ctx.metadata == "metadata"
+    assert not ctx.from_journal
+    assert len(transport.requests) == 1
+    assert sorted(timings) == sorted(["encode", "limit", "cache", "send", "decode", "journal"])
+
+
+def test_repeated_request_resumes_from_journal(tmp_path):
+    transport = FakeTransport(_png_bytes())
+    pipeline = GenerationPipeline(transport=transport, journal=ResultJournal(str(tmp_path)))
+
+    pipeline.run(_request())
+    ctx = pipeline.run(_request())
+
+    assert ctx.from_journal
+    assert len(transport.requests) == 1
+
+    pipeline.run(_request(resume_from_journal=False))
+    assert len(transport.requests) == 2
+
+
+def test_unwritable_journal_still_returns_result(tmp_path):
+    blocker = tmp_path / "blocker"
+    blocker.write_text("not a directory")
+    pipeline = GenerationPipeline(
+        transport=FakeTransport(_png_bytes()),
+        journal=ResultJournal(str(blocker / "journal"))
+    )
+
+    ctx = pipeline.run(_request())
+    assert ctx.image_tensor is not None
+
+
+def test_stages_and_transport_are_exclusive(tmp_path):
+    transport = FakeTransport(_png_bytes())
+    with pytest.raises(ValueError):
+        GenerationPipeline(stages=default_stages(transport), transport=transport)
+
+
+def test_limit_stage_rejects_zero():
+    with pytest.raises(ValueError):
+        LimitStage(0)
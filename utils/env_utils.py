@@ -0,0 +1,16 @@
+import os
+
+def get_env_number(name, default, minimum=0, cast=float):
+    """Read a numeric setting from the environment, falling back to the default if missing or invalid."""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        number = cast(value)
+    except ValueError:
+        print(f"\033[93mNanoBanana Config Warning: {name}={value!r} is not a number, using {default}.\033[0m")
+        return default
+    if number < minimum:
+        print(f"\033[93mNanoBanana Config Warning: {name} must be at least {minimum}, using {default}.\033[0m")
+        return default
+    return number